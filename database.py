@@ -6,6 +6,7 @@ Import and use these functions in your API endpoints for database operations.
 """
 
 from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -17,13 +18,27 @@ load_dotenv()
 
 _client = None
 db = None
+_async_client = None
+async_db = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
+# Shared pool settings; zstd needs the zstandard package, zlib is built in
+_client_options = dict(
+    maxPoolSize=50,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=2000,
+    compressors="zstd,zlib",
+)
+
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = MongoClient(database_url, **_client_options)
     db = _client[database_name]
+    # Async client for request handlers; keep connections warm so the first
+    # request doesn't pay for connection setup
+    _async_client = AsyncIOMotorClient(database_url, minPoolSize=10, **_client_options)
+    async_db = _async_client[database_name]
 
 # Helper functions for common database operations
 def create_document(collection_name: str, data: Union[BaseModel, dict]):
@@ -43,13 +58,40 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     result = db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
     if limit:
         cursor = cursor.limit(limit)
     
     return list(cursor)
+
+async def create_document_async(collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp (async)"""
+    if async_db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    if isinstance(data, BaseModel):
+        data_dict = data.model_dump()
+    else:
+        data_dict = data.copy()
+
+    data_dict['created_at'] = datetime.now(timezone.utc)
+    data_dict['updated_at'] = datetime.now(timezone.utc)
+
+    result = await async_db[collection_name].insert_one(data_dict)
+    return str(result.inserted_id)
+
+async def get_documents_async(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None):
+    """Get documents from collection (async)"""
+    if async_db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    cursor = async_db[collection_name].find(filter_dict or {}, projection)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    return await cursor.to_list(length=None)
@@ -0,0 +1,16 @@
+"""
+Gunicorn configuration for production
+
+Run with: gunicorn -c gunicorn_conf.py main:app
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Heartbeat files on tmpfs avoid worker stalls on slow container disks
+worker_tmp_dir = "/dev/shm"
+keepalive = 5
+timeout = 30
@@ -1,100 +1,263 @@
+import base64
+import logging
 import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from bson import ObjectId
-import base64
+from bson.errors import InvalidId
+from gridfs.errors import NoFile
+from cachetools import TTLCache
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo.errors import BulkWriteError
+
+from database import async_db, create_document_async, get_documents_async
+from schemas import WalletStyle, Upload as UploadSchema
+
+logger = logging.getLogger(__name__)
+
+_styles = async_db["walletstyle"] if async_db is not None else None
+_uploads = async_db["upload"] if async_db is not None else None
+
+DEFAULT_STYLES = [
+    WalletStyle(
+        title="Carbon Fiber Slim Wallet",
+        description="Durable carbon fiber plates with RFID blocking.",
+        price=59.0,
+        images=[
+            "https://images.unsplash.com/photo-1585386959984-a4155223162d?auto=format&fit=crop&w=1200&q=60",
+        ],
+        finishes=["Matte Black", "Gunmetal", "Silver"],
+    ),
+    WalletStyle(
+        title="Aluminum Slim Wallet",
+        description="Lightweight anodized aluminum construction.",
+        price=49.0,
+        images=[
+            "https://images.unsplash.com/photo-1512496015851-a90fb38ba796?auto=format&fit=crop&w=1200&q=60",
+        ],
+        finishes=["Matte Black", "Navy", "Forest"],
+    ),
+    WalletStyle(
+        title="Titanium Slim Wallet",
+        description="Premium titanium with sleek edges.",
+        price=89.0,
+        images=[
+            "https://images.unsplash.com/photo-1562184552-1e86cae0b2d9?auto=format&fit=crop&w=1200&q=60",
+        ],
+        finishes=["Raw", "Stonewash", "Black Ti"],
+    ),
+]
+
+STYLE_PROJECTION = {"title": 1, "description": 1, "price": 1, "images": 1, "finishes": 1, "in_stock": 1}
+# Upload bodies can be megabytes; only the download endpoint reads them
+UPLOAD_META_PROJECTION = {"data": 0, "data_b64": 0}
+
+
+# Set once the styles collection is known to be non-empty; until then
+# list_styles retries seeding, so a DB that was down at boot still gets seeded
+_styles_seeded = False
+
+
+async def _seed_styles():
+    """Seed DEFAULT_STYLES into an empty collection.
 
-from database import db, create_document, get_documents
-from schemas import WalletStyle, Upload as UploadSchema, Order
+    The unique title index turns a concurrent worker's seed into duplicate
+    key errors, which an unordered insert skips past.
+    """
+    global _styles_seeded
+    if await _styles.estimated_document_count():
+        _styles_seeded = True
+        return
+    now = datetime.now(timezone.utc)
+    docs = [{**style.model_dump(), "created_at": now, "updated_at": now} for style in DEFAULT_STYLES]
+    try:
+        await _styles.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+    _styles_seeded = True
+
+
+async def _ensure_index(collection, keys, **kwargs):
+    """Create an index, logging rather than raising so one failure doesn't skip the rest."""
+    try:
+        await collection.create_index(keys, **kwargs)
+    except Exception:
+        logger.exception("Failed to create index %s on %s", keys, collection.name)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ensure indexes exist and default styles are seeded before serving requests."""
+    if async_db is not None:
+        # Don't block startup on an unreachable DB; /test reports it and
+        # list_styles retries seeding
+        await _ensure_index(_styles, [("in_stock", 1)])
+        await _ensure_index(_styles, "title", unique=True)
+        await _ensure_index(async_db["order"], [("status", 1), ("_id", -1)])
+        try:
+            await _seed_styles()
+        except Exception:
+            logger.exception("Failed to seed default wallet styles")
+    yield
+
+
+app = FastAPI(
+    title="Laser Engraved Slim Wallets API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
-app = FastAPI(title="Laser Engraved Slim Wallets API")
+# Explicit origins (comma-separated in CORS_ORIGINS) keep credentialed
+# requests valid; max_age lets browsers cache preflights for a day
+cors_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=cors_origins or ["http://localhost:3000"],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["content-type", "authorization"],
+    max_age=86400,
 )
 
+# Wallet styles change rarely; serve the assembled response from memory.
+# Call _styles_cache.clear() from any endpoint that writes styles.
+_styles_cache = TTLCache(maxsize=1, ttl=60)
+
+SHIPPING_CENTS = 500
+FREE_SHIPPING_MIN_CENTS = 7500
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_INLINE_MAX_SIZE = 15 * 1024 * 1024
+
 
 @app.get("/")
-def root():
+async def root():
     return {"status": "ok", "service": "wallets-api"}
 
 
 @app.get("/api/styles")
-def list_styles():
-    """Return available wallet styles (seed minimal defaults if empty)."""
+async def list_styles():
+    """Return available wallet styles."""
     try:
-        styles = get_documents("walletstyle")
-        if not styles:
-            # Seed a few default styles if collection is empty
-            seeds = [
-                WalletStyle(
-                    title="Carbon Fiber Slim Wallet",
-                    description="Durable carbon fiber plates with RFID blocking.",
-                    price=59.0,
-                    images=[
-                        "https://images.unsplash.com/photo-1585386959984-a4155223162d?auto=format&fit=crop&w=1200&q=60",
-                    ],
-                    finishes=["Matte Black", "Gunmetal", "Silver"],
-                ),
-                WalletStyle(
-                    title="Aluminum Slim Wallet",
-                    description="Lightweight anodized aluminum construction.",
-                    price=49.0,
-                    images=[
-                        "https://images.unsplash.com/photo-1512496015851-a90fb38ba796?auto=format&fit=crop&w=1200&q=60",
-                    ],
-                    finishes=["Matte Black", "Navy", "Forest"],
-                ),
-                WalletStyle(
-                    title="Titanium Slim Wallet",
-                    description="Premium titanium with sleek edges.",
-                    price=89.0,
-                    images=[
-                        "https://images.unsplash.com/photo-1562184552-1e86cae0b2d9?auto=format&fit=crop&w=1200&q=60",
-                    ],
-                    finishes=["Raw", "Stonewash", "Black Ti"],
-                ),
-            ]
-            for s in seeds:
-                create_document("walletstyle", s)
-            styles = get_documents("walletstyle")
+        return _styles_cache["styles"]
+    except KeyError:
+        pass
+    try:
+        if not _styles_seeded and _styles is not None:
+            await _seed_styles()
+        styles = await get_documents_async("walletstyle", limit=100, projection=STYLE_PROJECTION)
         # Convert ObjectId to string if present
         for s in styles:
             if "_id" in s:
                 s["id"] = str(s.pop("_id"))
-        return {"styles": styles}
+        result = {"styles": styles}
+        _styles_cache["styles"] = result
+        return result
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        return ORJSONResponse(status_code=500, content={"error": str(e)})
 
 
 @app.post("/api/upload")
 async def upload_art(file: UploadFile = File(...)):
-    """Accept an image upload and store as base64 in DB, return upload id."""
+    """Accept an image upload and store its raw bytes in DB, return upload id."""
     try:
-        content = await file.read()
-        data_b64 = base64.b64encode(content).decode("utf-8")
-        doc = UploadSchema(
-            filename=file.filename,
-            content_type=file.content_type or "application/octet-stream",
-            size=len(content),
-            data_b64=data_b64,
-        )
-        upload_id = create_document("upload", doc)
+        filename = file.filename
+        content_type = file.content_type or "application/octet-stream"
+        # Small files are stored inline; anything that would push the
+        # document past Mongo's 16 MB limit is streamed into GridFS
+        content = await file.read(UPLOAD_INLINE_MAX_SIZE + 1)
+        if len(content) <= UPLOAD_INLINE_MAX_SIZE:
+            doc = UploadSchema(
+                filename=filename,
+                content_type=content_type,
+                size=len(content),
+                data=content,
+            )
+        else:
+            bucket = AsyncIOMotorGridFSBucket(async_db)
+            grid_in = bucket.open_upload_stream(filename, metadata={"content_type": content_type})
+            size = 0
+            while content:
+                await grid_in.write(content)
+                size += len(content)
+                content = await file.read(UPLOAD_CHUNK_SIZE)
+            await grid_in.close()
+            doc = UploadSchema(
+                filename=filename,
+                content_type=content_type,
+                size=size,
+                file_id=str(grid_in._id),
+            )
+        upload_id = await create_document_async("upload", doc)
         return {"upload_id": upload_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+async def _find_upload(upload_id: str, projection: Optional[dict] = None):
+    if _uploads is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+    try:
+        oid = ObjectId(upload_id)
+    except InvalidId as e:
+        raise HTTPException(status_code=400, detail=f"bad upload_id: {e}")
+    doc = await _uploads.find_one({"_id": oid}, projection)
+    if not doc:
+        raise HTTPException(status_code=404, detail=f"Upload not found: {upload_id}")
+    return doc
+
+
+@app.get("/api/upload/{upload_id}")
+async def get_upload(upload_id: str):
+    """Return upload metadata without the file contents."""
+    doc = await _find_upload(upload_id, UPLOAD_META_PROJECTION)
+    return {
+        "upload_id": str(doc["_id"]),
+        "filename": doc.get("filename"),
+        "content_type": doc.get("content_type"),
+        "size": doc.get("size"),
+    }
+
+
+@app.get("/api/upload/{upload_id}/content")
+async def download_upload(upload_id: str):
+    """Return the raw bytes of an upload."""
+    doc = await _find_upload(upload_id)
+    media_type = doc.get("content_type")
+    if doc.get("file_id"):
+        bucket = AsyncIOMotorGridFSBucket(async_db)
+        try:
+            grid_out = await bucket.open_download_stream(ObjectId(doc["file_id"]))
+        except NoFile:
+            raise HTTPException(status_code=404, detail=f"Upload content not found: {upload_id}")
+        return StreamingResponse(
+            _iter_grid_out(grid_out),
+            media_type=media_type,
+            headers={"Content-Length": str(grid_out.length)},
+        )
+    if doc.get("data") is not None:
+        return Response(content=doc["data"], media_type=media_type)
+    # Uploads stored before raw binary storage only have the base64 field
+    if doc.get("data_b64") is not None:
+        return Response(content=base64.b64decode(doc["data_b64"]), media_type=media_type)
+    raise HTTPException(status_code=404, detail=f"Upload content not found: {upload_id}")
+
+
+async def _iter_grid_out(grid_out):
+    while chunk := await grid_out.readchunk():
+        yield chunk
+
+
 class CartItemIn(BaseModel):
     product_id: str
-    quantity: int = 1
+    quantity: int = Field(1, ge=1)
     finish: Optional[str] = None
     engraving_text: Optional[str] = None
     upload_id: Optional[str] = None
@@ -117,42 +280,57 @@ class CheckoutIn(BaseModel):
 
 
 @app.post("/api/checkout")
-def checkout(payload: CheckoutIn):
+async def checkout(payload: CheckoutIn):
     """
     Create a simple order record. Payment is mocked for now (status pending).
     """
     try:
         # Calculate totals based on DB product prices
         items_full = []
-        subtotal = 0.0
+        subtotal_cents = 0
+        # Validate ids before touching the DB, then fetch all referenced
+        # products in one round-trip
+        try:
+            oids = {item.product_id: ObjectId(item.product_id) for item in payload.items}
+        except InvalidId as e:
+            raise HTTPException(status_code=400, detail=f"bad product_id: {e}")
+        cursor = _styles.find({"_id": {"$in": list(set(oids.values()))}}, {"title": 1, "price": 1})
+        by_id = {d["_id"]: d async for d in cursor}
+        # Work in integer cents so totals are exact and need no rounding
+        cents_by_id = {pid: int(round(float(d.get("price", 0)) * 100)) for pid, d in by_id.items()}
         for item in payload.items:
-            prod = db["walletstyle"].find_one({"_id": ObjectId(item.product_id)})
+            oid = oids[item.product_id]
+            prod = by_id.get(oid)
             if not prod:
                 raise HTTPException(status_code=404, detail=f"Product not found: {item.product_id}")
-            price = float(prod.get("price", 0)) * int(item.quantity)
-            subtotal += price
+            price_each_cents = cents_by_id[oid]
+            qty = item.quantity
+            subtotal_cents += price_each_cents * qty
             items_full.append({
                 "product_id": item.product_id,
                 "title": prod.get("title"),
-                "price_each": float(prod.get("price", 0)),
-                "quantity": int(item.quantity),
+                "price_each_cents": price_each_cents,
+                "quantity": qty,
                 "finish": item.finish,
                 "engraving_text": item.engraving_text,
                 "upload_id": item.upload_id,
             })
-        shipping = 5.0 if subtotal < 75 else 0.0
-        total = round(subtotal + shipping, 2)
-
-        order_doc = Order(
-            items=items_full,  # type: ignore
-            customer=payload.customer.model_dump(),  # type: ignore
-            subtotal=round(subtotal, 2),
-            shipping=shipping,
-            total=total,
-            status="pending",
-        )
-        order_id = create_document("order", order_doc)
-        return {"order_id": order_id, "status": "pending", "amount": total}
+        shipping_cents = 0 if subtotal_cents >= FREE_SHIPPING_MIN_CENTS else SHIPPING_CENTS
+        total_cents = subtotal_cents + shipping_cents
+
+        # payload is already validated, so build the insert dict directly
+        # rather than re-validating it through the Order model
+        order_doc = {
+            "items": items_full,
+            "customer": payload.customer.model_dump(),
+            "subtotal_cents": subtotal_cents,
+            "shipping_cents": shipping_cents,
+            "total_cents": total_cents,
+            "status": "pending",
+            "notes": None,
+        }
+        order_id = await create_document_async("order", order_doc)
+        return {"order_id": order_id, "status": "pending", "amount": total_cents / 100}
     except HTTPException:
         raise
     except Exception as e:
@@ -160,15 +338,23 @@ def checkout(payload: CheckoutIn):
 
 
 @app.get("/api/schema")
-def get_schema_info():
+async def get_schema_info():
     """Expose basic schema info for tooling."""
     return {
         "collections": ["walletstyle", "upload", "order"],
     }
 
 
+# Healthchecks are polled often; env vars can't change at runtime and the
+# collection list only needs to be roughly current
+_DATABASE_URL_STATUS = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+_DATABASE_NAME_STATUS = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+_collections_cache = TTLCache(maxsize=1, ttl=30)
+
+
 @app.get("/test")
-def test_database():
+async def test_database(light: bool = False):
+    """Report backend/DB status. Pass ?light=1 to skip listing collections."""
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -178,14 +364,20 @@ def test_database():
         "collections": []
     }
     try:
-        if db is not None:
+        if async_db is not None:
             response["database"] = "✅ Connected"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
-            try:
-                response["collections"] = db.list_collection_names()
-            except Exception:
-                pass
+            response["database_url"] = _DATABASE_URL_STATUS
+            response["database_name"] = _DATABASE_NAME_STATUS
+            if not light:
+                try:
+                    response["collections"] = _collections_cache["names"]
+                except KeyError:
+                    try:
+                        names = await async_db.list_collection_names()
+                        _collections_cache["names"] = names
+                        response["collections"] = names
+                    except Exception:
+                        pass
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:80]}"
     return response
@@ -194,4 +386,7 @@ def test_database():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Local dev entrypoint: one worker unless asked; production sizing lives
+    # in gunicorn_conf.py
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="uvloop", http="httptools", workers=workers)
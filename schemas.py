@@ -27,7 +27,8 @@ class Upload(BaseModel):
     filename: str
     content_type: str
     size: int
-    data_b64: str = Field(..., description="Base64-encoded file contents")
+    data: Optional[bytes] = Field(None, description="Raw file contents (stored inline as BSON binary)")
+    file_id: Optional[str] = Field(None, description="GridFS file id for uploads too large to store inline")
 
 class CartItem(BaseModel):
     product_id: str
@@ -53,8 +54,8 @@ class Order(BaseModel):
     """
     items: List[CartItem]
     customer: Customer
-    subtotal: float = Field(..., ge=0)
-    shipping: float = Field(..., ge=0)
-    total: float = Field(..., ge=0)
+    subtotal_cents: int = Field(..., ge=0, description="Subtotal in USD cents")
+    shipping_cents: int = Field(..., ge=0, description="Shipping in USD cents")
+    total_cents: int = Field(..., ge=0, description="Total in USD cents")
     status: str = Field("pending", description="pending|processing|completed|cancelled")
     notes: Optional[str] = None